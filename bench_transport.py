@@ -0,0 +1,112 @@
+"""Benchmark de handshakes por mensaje: Sheets reconstruido vs transporte compartido.
+
+Levanta un servidor HTTP local con keep-alive por cada host upstream y simula el
+tráfico de un mensaje de gasto: 2 llamadas a OpenAI (clasificar y extraer), 3 a
+Notion (retrieve, query, crear página) y la escritura en Sheets. Cada conexión TCP
+nueva equivale a un handshake TLS contra los upstream reales.
+
+"antes" reproduce el baseline: OpenAI y Notion ya eran clientes compartidos, pero
+cada escritura en Sheets creaba credenciales y sesión nuevas (token OAuth, open en
+Drive, metadata, row_values y append_row).
+
+Uso: python bench_transport.py [mensajes]
+"""
+import asyncio
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import transport
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with _Handler.lock:
+            _Handler.connections += 1
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+HOSTS = ("openai", "notion", "oauth", "drive", "sheets")
+
+def _write_sheet(urls, auth_session, api_session, sheet_ready):
+    if not sheet_ready:
+        # Credenciales nuevas: token OAuth, luego open (Drive + metadata) y row_values(1)
+        auth_session.post(f"{urls['oauth']}/token", data={})
+        api_session.get(f"{urls['drive']}/files")
+        api_session.get(f"{urls['sheets']}/metadata")
+        api_session.get(f"{urls['sheets']}/row_values")
+    api_session.post(f"{urls['sheets']}/append_row", json={})
+
+async def _send_message(urls, openai_client, notion_client):
+    openai_client.post(f"{urls['openai']}/chat/completions", json={})
+    openai_client.post(f"{urls['openai']}/chat/completions", json={})
+    await notion_client.post(f"{urls['notion']}/databases/retrieve", json={})
+    await notion_client.post(f"{urls['notion']}/data_sources/query", json={})
+    await notion_client.post(f"{urls['notion']}/pages", json={})
+
+async def _run(urls, messages, shared):
+    _Handler.connections = 0
+    transport.reset_connection_stats()
+    openai_client = transport.build_client("openai")
+    notion_client = transport.build_async_client("notion")
+    try:
+        if shared:
+            auth_session = transport.build_session("oauth")
+            api_session = transport.build_session("sheets")
+            try:
+                for i in range(messages):
+                    await _send_message(urls, openai_client, notion_client)
+                    _write_sheet(urls, auth_session, api_session, sheet_ready=i > 0)
+            finally:
+                auth_session.close()
+                api_session.close()
+        else:
+            for _ in range(messages):
+                await _send_message(urls, openai_client, notion_client)
+                with transport.build_session("oauth") as auth_session, transport.build_session("sheets") as api_session:
+                    _write_sheet(urls, auth_session, api_session, sheet_ready=False)
+    finally:
+        openai_client.close()
+        await notion_client.aclose()
+    return _Handler.connections, transport.connection_stats()
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    servers = {name: ThreadingHTTPServer(("127.0.0.1", 0), _Handler) for name in HOSTS}
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = {name: f"http://127.0.0.1:{server.server_port}" for name, server in servers.items()}
+    try:
+        for label, shared in (("antes (Sheets por escritura)", False), ("después (transporte compartido)", True)):
+            connections, stats = asyncio.run(_run(urls, messages, shared))
+            requests_total = sum(c["requests"] for c in stats.values())
+            print(f"{label}: {messages} mensajes, {requests_total} requests, {connections} handshakes "
+                  f"({connections / messages:.2f} por mensaje)")
+            for upstream, counters in sorted(stats.items()):
+                print(f"  {upstream}: {counters}")
+    finally:
+        for server in servers.values():
+            server.shutdown()
+            server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,13 @@ from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, Con
 from openai import OpenAI
 import gspread
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession, Request
 from notion import actualizar_deudor_deuda, add_new_page, generate_deudor, get_data_source_id, get_database_id, generate_page, get_deudor_deuda, get_deudores, get_month_expences, get_month_valance, map_expences
 from datetime import datetime
-from threading import Thread
+from threading import Thread, Lock
 from flask import Flask
+from transport import build_client, build_session, format_connection_stats, upstream_timeouts
+from dispatcher import ChatDispatcher
 
 # === Cargar variables .env ===
 load_dotenv()
@@ -21,12 +24,22 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SHEET_NAME = os.getenv("GSPREAD_SHEET_NAME", "gastos_diarios")
 SA_JSON_PATH = os.getenv("GSPREAD_SA_JSON", "./service_account.json")
 TZ = pytz.timezone(os.getenv("TZ", "America/Bogota"))
+MAX_CONCURRENCY = int(os.getenv("BOT_MAX_CONCURRENCY", "4"))
+CHAT_BUSY_THRESHOLD = int(os.getenv("BOT_CHAT_BUSY_THRESHOLD", "3"))
 
 fecha = datetime.now()
 year = str(fecha.year)
 
 # === Inicializar clientes ===
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = OpenAI(api_key=OPENAI_API_KEY, http_client=build_client("openai"))
+def log_connection_stats():
+    print(f"[DEBUG] Conexiones: {format_connection_stats()}")
+
+dispatcher = ChatDispatcher(
+    max_concurrency=MAX_CONCURRENCY,
+    busy_threshold=CHAT_BUSY_THRESHOLD,
+    after_message=log_connection_stats,
+)
 
 # === Google Sheets helpers ===
 HEADERS = ["fecha","hora","valor","comercio","categoria","subcategoria","detalle", "cuenta"]
@@ -47,24 +60,46 @@ def ensure_sa_file():
 
 ensure_sa_file()
 
+# Cliente y hoja se construyen una sola vez para reutilizar la conexión entre mensajes
+_gspread_client = None
+_worksheet = None
+# Las llamadas a Sheets corren en hilos (asyncio.to_thread), la inicialización va con lock
+_gspread_lock = Lock()
+
 def gspread_client():
-    scopes = ["https://www.googleapis.com/auth/spreadsheets","https://www.googleapis.com/auth/drive"]
-    creds = Credentials.from_service_account_file(SA_JSON_PATH, scopes=scopes)
-    return gspread.authorize(creds)
+    global _gspread_client
+    with _gspread_lock:
+        if _gspread_client is not None:
+            return _gspread_client
+        scopes = ["https://www.googleapis.com/auth/spreadsheets","https://www.googleapis.com/auth/drive"]
+        creds = Credentials.from_service_account_file(SA_JSON_PATH, scopes=scopes)
+        # El refresco del token OAuth también va por una sesión contada
+        auth_request = Request(session=build_session("oauth"))
+        session = build_session("sheets", AuthorizedSession(creds, auth_request=auth_request))
+        _gspread_client = gspread.Client(auth=creds, session=session)
+        _gspread_client.set_timeout(upstream_timeouts("sheets"))
+        return _gspread_client
 
 def get_or_create_sheet():
-    print(f"[DEBUG] Conectando a Google Sheets: {SHEET_NAME}")
+    global _worksheet
+    if _worksheet is not None:
+        return _worksheet
     gc = gspread_client()
-    sh = gc.open(SHEET_NAME)
-    ws = sh.sheet1
-    first_row = ws.row_values(1)
-    print(f"[DEBUG] Primera fila de la hoja: {first_row}")
-    if [h.lower() for h in first_row] != HEADERS:
-        print(f"[DEBUG] Headers no coinciden, limpiando y estableciendo nuevos...")
-        ws.clear()
-        ws.append_row(HEADERS)
-        print(f"[DEBUG] Headers establecidos correctamente")
-    return ws
+    with _gspread_lock:
+        if _worksheet is not None:
+            return _worksheet
+        print(f"[DEBUG] Conectando a Google Sheets: {SHEET_NAME}")
+        sh = gc.open(SHEET_NAME)
+        ws = sh.sheet1
+        first_row = ws.row_values(1)
+        print(f"[DEBUG] Primera fila de la hoja: {first_row}")
+        if [h.lower() for h in first_row] != HEADERS:
+            print(f"[DEBUG] Headers no coinciden, limpiando y estableciendo nuevos...")
+            ws.clear()
+            ws.append_row(HEADERS)
+            print(f"[DEBUG] Headers establecidos correctamente")
+        _worksheet = ws
+        return ws
 
 async def add_to_notion(rec):
     print(f"[DEBUG] Preparando registro para Notion: {rec}")
@@ -295,6 +330,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Ejemplo: 'pago novaventa 15000'.\n-----------------\n"
         "-Para mirar cuanto se ha gastado en el mes: usar /gastos.\n"
         "-Para mirar todos los gastos del mes: usar /balance.\n"
+        "-Para ver la cola de mensajes pendientes: usar /cola.\n"
     )
     print(f"[DEBUG] Mensaje de inicio enviado")
 
@@ -319,27 +355,36 @@ async def deudas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(deudores_list)
 
 # actualizando tablas
+# Las tablas de deudores/deudas se comparten entre chats que corren en paralelo;
+# un lock por tabla evita que dos abonos lean el mismo 'pagado' y uno se pierda
+LEDGER_LOCKS = {"deudores": asyncio.Lock(), "deudas": asyncio.Lock()}
+
+def ledger_lock(tipo):
+    return LEDGER_LOCKS["deudores" if tipo in ("-deudor", "-abono") else "deudas"]
+
 async def add_deudor_deuda(update: Update, tipo, detalle, total):
     print(f"[DEBUG] Creando página para {tipo}: {detalle}")
     page = generate_deudor(detalle, total)
-    print(f"[DEBUG] Obteniendo ID de base de datos para año {year}...")
-    db = await get_database_id(year)
-    db_id = db[2] if tipo=="-deudor" else db[1]
-    print(f"[DEBUG] DB ID obtenido: {db_id}")
-    print(f"[DEBUG] Agregando página a Notion...")
-    await add_new_page(db_id, page)
-    print(f"[DEBUG] {tipo.capitalize()} registrado en Notion")
+    async with ledger_lock(tipo):
+        print(f"[DEBUG] Obteniendo ID de base de datos para año {year}...")
+        db = await get_database_id(year)
+        db_id = db[2] if tipo=="-deudor" else db[1]
+        print(f"[DEBUG] DB ID obtenido: {db_id}")
+        print(f"[DEBUG] Agregando página a Notion...")
+        await add_new_page(db_id, page)
+        print(f"[DEBUG] {tipo.capitalize()} registrado en Notion")
     await update.message.reply_text(f"{tipo.capitalize()} {detalle} {format_number_with_decimals(int(total))} registrado correctamente.")
 
 async def add_abono_pago(update: Update,tipo,detalle, pago):
     print(f"[DEBUG] Procesando {tipo} para {detalle}")
-    db = await get_database_id(year)
-    db_id = db[2] if tipo=="-abono" else db[1]
-    print(f"[DEBUG] DB ID obtenido: {db_id}")
-    data_source_id = await get_data_source_id(db_id)
-    print(f"[DEBUG] Data source ID obtenido: {data_source_id}")
-    await actualizar_deudor_deuda(data_source_id, detalle, pago)
-    print(f"[DEBUG] {tipo.capitalize()} actualizado en Notion")
+    async with ledger_lock(tipo):
+        db = await get_database_id(year)
+        db_id = db[2] if tipo=="-abono" else db[1]
+        print(f"[DEBUG] DB ID obtenido: {db_id}")
+        data_source_id = await get_data_source_id(db_id)
+        print(f"[DEBUG] Data source ID obtenido: {data_source_id}")
+        await actualizar_deudor_deuda(data_source_id, detalle, pago)
+        print(f"[DEBUG] {tipo.capitalize()} actualizado en Notion")
     await update.message.reply_text(f"{tipo.capitalize()} {detalle} {format_number_with_decimals(int(pago))} registrada correctamente.")
 
 async def month_valance(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -367,10 +412,21 @@ async def month_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE):
     print(f"[DEBUG] Gastos del mes obtenidos: {gastos}")
     await update.message.reply_text(mapped_gastos)
 
+async def queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    print(f"[DEBUG] Comando /cola ejecutado")
+    stats = dispatcher.stats()
+    print(f"[DEBUG] Estado de la cola: {stats}")
+    await update.message.reply_text(
+        f"Mensajes en cola: {stats['en_cola']} | En proceso: {stats['activos']}/{dispatcher.max_concurrency}\n"
+        f"Tu chat: {dispatcher.depth(update.effective_chat.id)} pendientes\n"
+        f"Espera promedio: {stats['espera_promedio']:.1f}s | Máxima: {stats['espera_maxima']:.1f}s\n"
+        f"Conexiones: {format_connection_stats()}"
+    )
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     print(f"[DEBUG] Mensaje recibido: {text}")
-    res = call_gpt_deuda_deudor(text)
+    res = await asyncio.to_thread(call_gpt_deuda_deudor, text)
     print(f"[DEBUG] Respuesta de GPT (deuda/deudor): {res}")
     if(res is None):
         print(f"[DEBUG] No se pudo parsear la respuesta de GPT")
@@ -403,7 +459,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"[DEBUG] Tipo detectado: gasto")
         try:
             print(f"[DEBUG] Llamando GPT para extraer detalles del gasto...")
-            rec = call_gpt_extract(text)
+            rec = await asyncio.to_thread(call_gpt_extract, text)
             print(f"[DEBUG] Respuesta de GPT (gasto): {rec}")
             if not rec:
                 print(f"[DEBUG] No se pudo parsear el gasto")
@@ -434,7 +490,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # Guardar
             print(f"[DEBUG] Guardando en Google Sheets...")
-            persist_to_gsheets(rec)
+            await asyncio.to_thread(persist_to_gsheets, rec)
             print(f"[DEBUG] Guardado en Sheets exitosamente")
             
             print(f"[DEBUG] Agregando a Notion...")
@@ -454,17 +510,24 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"Error: {e}")
 
 
+async def drain_queues(application):
+    # Los updates ya encolados fueron confirmados a Telegram; procesarlos antes de cerrar el loop
+    await dispatcher.drain()
+
 def main():
     print("[DEBUG] Iniciando bot de gastos...")
     asyncio.set_event_loop(asyncio.new_event_loop())
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).post_stop(drain_queues).build()
     print("[DEBUG] Bot configurado correctamente")
     app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("deudores", deudores))
-    app.add_handler(CommandHandler("deudas", deudas))
-    app.add_handler(CommandHandler("balance", month_valance))
-    app.add_handler(CommandHandler("gastos", month_expenses))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    app.add_handler(CommandHandler("cola", queue_status))
+    # Las consultas también pasan por la cola del chat para ver los registros previos
+    app.add_handler(CommandHandler("deudores", dispatcher.wrap(deudores)))
+    app.add_handler(CommandHandler("deudas", dispatcher.wrap(deudas)))
+    app.add_handler(CommandHandler("balance", dispatcher.wrap(month_valance)))
+    app.add_handler(CommandHandler("gastos", dispatcher.wrap(month_expenses)))
+    # PTB entrega updates en orden y el handler solo encola; el paralelismo entre chats lo da el dispatcher
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, dispatcher.wrap(handle_text)))
     print("[DEBUG] Handlers registrados. Iniciando polling...")
     app.run_polling()
 
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+
+# === Despachador por chat ===
+# Cada chat tiene su propia cola FIFO atendida por un único worker, así un
+# "abono" nunca se procesa antes del "deudor" al que se refiere. Chats distintos
+# corren en paralelo hasta max_concurrency handlers activos en total.
+
+class ChatDispatcher:
+    def __init__(self, max_concurrency=4, busy_threshold=3, wait_samples=100, after_message=None):
+        self.max_concurrency = max_concurrency
+        self.busy_threshold = busy_threshold
+        self.after_message = after_message
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues = {}
+        self._workers = {}
+        self._active = set()
+        self._running = 0
+        self._waits = deque(maxlen=wait_samples)
+
+    def wrap(self, callback):
+        """Convierte un handler de Telegram en uno que encola por chat."""
+        async def handler(update, context):
+            await self.submit(update, context, callback)
+        return handler
+
+    def depth(self, chat_id):
+        """Mensajes pendientes del chat, incluyendo el que se está procesando."""
+        return len(self._queues.get(chat_id, ())) + (1 if chat_id in self._active else 0)
+
+    async def submit(self, update, context, callback):
+        chat_id = update.effective_chat.id
+        ahead = self.depth(chat_id)
+        # Encolar antes de cualquier await para conservar el orden de llegada
+        self._queues.setdefault(chat_id, deque()).append((time.monotonic(), callback, update, context))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._worker(chat_id))
+        print(f"[DEBUG] Chat {chat_id}: mensaje encolado, {ahead} por delante")
+        if ahead >= self.busy_threshold and update.message:
+            # PTB procesa updates en orden: no esperar la respuesta para no frenar a los demás chats
+            context.application.create_task(
+                update.message.reply_text(f"⏳ Estoy ocupado, tu mensaje quedó en cola ({ahead} pendientes antes)."),
+                update=update,
+            )
+
+    async def drain(self):
+        """Espera a que se procesen todos los mensajes encolados (usar antes de apagar)."""
+        while self._workers:
+            pending = sum(self.depth(chat_id) for chat_id in self._queues)
+            print(f"[DEBUG] Esperando {pending} mensajes en cola antes de apagar...")
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+        print(f"[DEBUG] Colas vacías")
+
+    async def _worker(self, chat_id):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                enqueued_at, callback, update, context = queue.popleft()
+                self._active.add(chat_id)
+                try:
+                    async with self._semaphore:
+                        wait = time.monotonic() - enqueued_at
+                        self._waits.append(wait)
+                        print(f"[DEBUG] Chat {chat_id}: procesando tras {wait:.2f}s en cola, {len(queue)} pendientes")
+                        self._running += 1
+                        try:
+                            await callback(update, context)
+                        finally:
+                            self._running -= 1
+                except Exception as e:
+                    print(f"[DEBUG] Error en handler del chat {chat_id}: {e}")
+                    traceback.print_exc()
+                finally:
+                    self._active.discard(chat_id)
+                    if self.after_message:
+                        self.after_message()
+        finally:
+            del self._workers[chat_id]
+            del self._queues[chat_id]
+
+    def stats(self):
+        waits = list(self._waits)
+        return {
+            "chats": len(self._workers),
+            "activos": self._running,
+            "en_cola": sum(len(q) for q in self._queues.values()),
+            "profundidad_por_chat": {chat_id: self.depth(chat_id) for chat_id in self._queues},
+            "espera_promedio": sum(waits) / len(waits) if waits else 0.0,
+            "espera_maxima": max(waits) if waits else 0.0,
+        }
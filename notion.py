@@ -1,9 +1,10 @@
 from notion_client import AsyncClient
 import os
 from dotenv import load_dotenv
+from transport import build_async_client
 
 load_dotenv()
-notion = AsyncClient(auth=os.getenv("NOTION_TOKEN"))
+notion = AsyncClient(auth=os.getenv("NOTION_TOKEN"), client=build_async_client("notion"))
 finances_db_id = os.getenv("FINANCES_PAGE_TABLE")
 
 def format_number_with_decimals(number):
@@ -0,0 +1,175 @@
+import os
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from dotenv import load_dotenv
+
+# === Transporte HTTP compartido ===
+# Todos los clientes del bot (OpenAI, Notion y Google Sheets) se construyen aquí
+# para reutilizar conexiones keep-alive en lugar de repetir el handshake TLS
+# en cada mensaje.
+
+load_dotenv()
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        print(f"[DEBUG] Valor inválido para {name}, usando {default}")
+        return float(default)
+
+# (connect, read) en segundos por upstream. Se pueden sobreescribir con
+# HTTP_<UPSTREAM>_CONNECT_TIMEOUT y HTTP_<UPSTREAM>_READ_TIMEOUT en el .env
+DEFAULT_TIMEOUTS = {
+    "openai": (5.0, 60.0),
+    "notion": (5.0, 30.0),
+    "sheets": (5.0, 30.0),
+}
+
+MAX_CONNECTIONS = int(_env_float("HTTP_MAX_CONNECTIONS", 10))
+MAX_KEEPALIVE = int(_env_float("HTTP_MAX_KEEPALIVE", 5))
+# Cantidad de pools por host que guarda urllib3 (no es un número de conexiones)
+HOST_POOLS = int(_env_float("HTTP_HOST_POOLS", 10))
+KEEPALIVE_EXPIRY = _env_float("HTTP_KEEPALIVE_EXPIRY", 60)
+
+try:
+    import h2  # noqa: F401  (httpx solo negocia HTTP/2 si está instalado)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+def upstream_timeouts(upstream):
+    connect, read = DEFAULT_TIMEOUTS[upstream]
+    prefix = f"HTTP_{upstream.upper()}"
+    return (
+        _env_float(f"{prefix}_CONNECT_TIMEOUT", connect),
+        _env_float(f"{prefix}_READ_TIMEOUT", read),
+    )
+
+def httpx_timeout(upstream):
+    connect, read = upstream_timeouts(upstream)
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+
+# === Contador de reutilización de conexiones ===
+_stats_lock = threading.Lock()
+_stats = {}
+
+def _bump(upstream, key, amount=1):
+    with _stats_lock:
+        counters = _stats.setdefault(upstream, {"requests": 0, "connections": 0, "tls_handshakes": 0})
+        counters[key] += amount
+
+def connection_stats():
+    """Devuelve por upstream: requests, conexiones nuevas, handshakes TLS y conexiones reutilizadas."""
+    with _stats_lock:
+        result = {name: dict(counters) for name, counters in _stats.items()}
+    for counters in result.values():
+        counters["reused"] = max(counters["requests"] - counters["connections"], 0)
+    return result
+
+def reset_connection_stats():
+    with _stats_lock:
+        _stats.clear()
+
+def format_connection_stats():
+    stats = connection_stats()
+    if not stats:
+        return "sin conexiones"
+    return " | ".join(
+        f"{name}: {c['requests']} req, {c['connections']} conexiones, {c['reused']} reutilizadas"
+        for name, c in sorted(stats.items())
+    )
+
+def _on_trace_event(upstream, event_name):
+    if event_name == "connection.connect_tcp.complete":
+        _bump(upstream, "connections")
+    elif event_name == "connection.start_tls.complete":
+        _bump(upstream, "tls_handshakes")
+
+# === Clientes httpx (OpenAI y Notion) ===
+def _limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+def build_client(upstream):
+    """Cliente httpx síncrono con pool keep-alive para el upstream dado."""
+    timeout = httpx_timeout(upstream)
+
+    def trace(event_name, info):
+        _on_trace_event(upstream, event_name)
+
+    def on_request(request):
+        # Los SDKs envían su propio timeout por request; forzamos el del upstream
+        request.extensions["timeout"] = timeout.as_dict()
+        request.extensions["trace"] = trace
+        _bump(upstream, "requests")
+
+    return httpx.Client(
+        http2=HTTP2,
+        limits=_limits(),
+        timeout=timeout,
+        event_hooks={"request": [on_request]},
+    )
+
+def build_async_client(upstream):
+    """Cliente httpx asíncrono con pool keep-alive para el upstream dado."""
+    timeout = httpx_timeout(upstream)
+
+    async def trace(event_name, info):
+        _on_trace_event(upstream, event_name)
+
+    async def on_request(request):
+        request.extensions["timeout"] = timeout.as_dict()
+        request.extensions["trace"] = trace
+        _bump(upstream, "requests")
+
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        limits=_limits(),
+        timeout=timeout,
+        event_hooks={"request": [on_request]},
+    )
+
+# === Sesión requests (gspread usa requests, sin HTTP/2) ===
+def _counting_pool(base, upstream):
+    # Se cuenta al crear cada conexión; el contador no se pierde si urllib3 descarta el pool
+    class CountingPool(base):
+        def _new_conn(self):
+            _bump(upstream, "connections")
+            if self.scheme == "https":
+                _bump(upstream, "tls_handshakes")
+            return super()._new_conn()
+    return CountingPool
+
+class CountingAdapter(HTTPAdapter):
+    def __init__(self, upstream, **kwargs):
+        self.upstream = upstream
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.upstream),
+            "https": _counting_pool(HTTPSConnectionPool, self.upstream),
+        }
+
+def mount_pooled_adapter(session, upstream):
+    """Monta un adapter con pool keep-alive en la sesión y cuenta sus requests y conexiones."""
+    adapter = CountingAdapter(upstream, pool_connections=HOST_POOLS, pool_maxsize=MAX_CONNECTIONS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    def on_response(response, *args, **kwargs):
+        _bump(upstream, "requests")
+
+    session.hooks.setdefault("response", []).append(on_response)
+    return session
+
+def build_session(upstream="sheets", session=None):
+    return mount_pooled_adapter(session if session is not None else requests.Session(), upstream)